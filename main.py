@@ -1,5 +1,12 @@
 import os
+import json
+import queue
 import argparse
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 from tqdm import tqdm
 from parser import extract_classes_and_methods
 from mongo_utils import insert_fragment, is_file_unchanged, update_file_hash, calculate_file_hash
@@ -9,106 +16,311 @@ from sentence_transformers import SentenceTransformer
 # -------- CONFIG --------
 REPO_FOLDER = os.getenv("REPO_FOLDER", "/app/repo_to_index")
 MODEL_NAME = "all-MiniLM-L6-v2"  # lightweight, fast embedding model
+INDEX_WORKERS = int(os.getenv("INDEX_WORKERS", "4"))  # threads walking/parsing files
+FILE_BATCH_SIZE = int(os.getenv("INDEX_FILE_BATCH", "20"))  # files per scheduled work unit
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))  # fragments per model.encode call
+EMBED_QUEUE_FILES = 256  # parsed files waiting for embeddings before parsers block
 
 # -------- LOAD MODEL --------
 print("Loading embedding model...")
 model = SentenceTransformer(MODEL_NAME)
 
-def get_embedding(code_text):
-    """Generate embedding vector using sentence-transformers."""
-    return model.encode(code_text).tolist()
+def get_embeddings(code_texts: List[str]) -> List[List[float]]:
+    """Generate embedding vectors for a batch of code fragments using sentence-transformers."""
+    return [emb.tolist() for emb in model.encode(code_texts, batch_size=EMBED_BATCH_SIZE)]
 
-def main(full_rescan: bool = False):
-    print(f"Indexing starting. REPO_FOLDER={REPO_FOLDER}")
-    print(f"Mode: {'FULL RESCAN' if full_rescan else 'INCREMENTAL (MD5 cache)'}")
+def neo4j_enabled() -> bool:
+    return os.getenv("NEO4J_ENABLED", "true").lower() not in {"0", "false", "no"}
 
-    all_fragments = []
-    all_calls = []
-    total_files = 0
-    skipped_files = 0
-    processed_files = 0
+def _prefix(repo: Optional[str]) -> str:
+    return f"[{repo}] " if repo else ""
 
-    # Walk the repo folder
-    for root, _, files in os.walk(REPO_FOLDER):
+def iter_java_files(repo_folder: str) -> Iterator[str]:
+    for root, _, files in os.walk(repo_folder):
         for file in files:
             # accept case-insensitive .java
-            if not file.lower().endswith(".java"):
-                continue
-                
-            path = os.path.join(root, file)
-            total_files += 1
-            
-            # Skip unchanged files
-            if not full_rescan and is_file_unchanged(path):
-                skipped_files += 1
-                print(f"Skipping unchanged file: {path}")
-                continue
-                
-            print(f"Processing: {path}")
-            fragments = extract_classes_and_methods(path)
+            if file.lower().endswith(".java"):
+                yield os.path.join(root, file)
+
+def schedule_batches(repos: List[Dict[str, Any]], batch_size: int = FILE_BATCH_SIZE) -> Iterator[Tuple[Dict[str, Any], List[str]]]:
+    """Yield (repo, file paths) work units.
 
-            # Update hash for any processed file (even if no fragments were found)
+    Higher priorities are drained first. Repos with the same priority are
+    interleaved round-robin, one batch of files each, so a large repo queued
+    late does not hold a worker for its whole run.
+    """
+    by_priority: Dict[int, List[Dict[str, Any]]] = {}
+    for r in repos:
+        by_priority.setdefault(r["priority"], []).append(r)
+
+    for priority in sorted(by_priority, reverse=True):
+        active = deque((r, iter_java_files(r["path"])) for r in by_priority[priority])
+        while active:
+            r, files = active.popleft()
+            batch = list(islice(files, batch_size))
+            if batch:
+                yield r, batch
+            if len(batch) == batch_size:
+                active.append((r, files))
+
+def insert_calls(repo: Optional[str], fragments: List[Dict[str, Any]], repo_stats: Dict[str, int],
+                 lock: threading.Lock) -> None:
+    prefix = _prefix(repo)
+    for frag in fragments:
+        if frag.get("type") != "method":  # only method -> method edges
+            continue
+        for callee in frag.get("calls", []):
+            # If we get repeated auth/rate-limit errors, stop spamming
+            if repo_stats["neo4j_errors"] >= 5:
+                return
             try:
-                file_hash = calculate_file_hash(path)
-                update_file_hash(path, file_hash)
+                insert_method_call(frag["symbol"], callee, repo)
             except Exception as e:
-                print(f"Warning: failed to update hash for {path}: {e}")
-            processed_files += 1
-                
-            all_fragments.extend(fragments)
-            for frag in fragments:
-                if frag.get("type") == "method":  # only method -> method edges
-                    for callee in frag.get("calls", []):
-                        all_calls.append({"caller": frag["symbol"], "callee": callee})
-
-    # Generate embeddings and insert into Mongo
-    for frag in tqdm(all_fragments):
+                with lock:
+                    repo_stats["neo4j_errors"] += 1
+                    errors = repo_stats["neo4j_errors"]
+                print(f"{prefix}Error inserting call {frag['symbol']} -> {callee}: {e}")
+                if errors == 5:
+                    print(f"{prefix}Too many Neo4j errors; stopping further inserts. Check NEO4J_* credentials and server status.")
+
+def graph_worker(graph_queue: "queue.Queue", stats: Dict[Optional[str], Dict[str, int]],
+                 lock: threading.Lock) -> None:
+    """Sole Neo4j writer.
+
+    MERGE has no uniqueness constraint behind it, so concurrent writers can
+    create duplicate Method nodes or deadlock on shared ones.
+    """
+    while True:
+        item = graph_queue.get()
+        if item is None:
+            break
+        insert_calls(item["repo"], item["fragments"], stats[item["repo"]], lock)
+
+def process_file_batch(repo: Optional[str], paths: List[str], full_rescan: bool,
+                       stats: Dict[Optional[str], Dict[str, int]], lock: threading.Lock,
+                       embed_queue: "queue.Queue", graph_queue: Optional["queue.Queue"]) -> None:
+    """Parse a batch of files and hand their fragments to the embedding and graph writers."""
+    prefix = _prefix(repo)
+    repo_stats = stats[repo]
+    for path in paths:
+        with lock:
+            repo_stats["total"] += 1
         try:
-            emb = get_embedding(frag["code"])
-            frag["embedding"] = emb
-            insert_fragment(frag)
+            # Skip unchanged files
+            if not full_rescan and is_file_unchanged(path, repo):
+                with lock:
+                    repo_stats["skipped"] += 1
+                print(f"{prefix}Skipping unchanged file: {path}")
+                continue
+
+            print(f"{prefix}Processing: {path}")
+            fragments = extract_classes_and_methods(path)
+            file_hash = calculate_file_hash(path)
         except Exception as e:
-            print(f"Error processing {frag['symbol']}: {e}")
+            with lock:
+                repo_stats["failed"] += 1
+            print(f"{prefix}Warning: failed to process {path}: {e}")
+            continue
 
-    # Insert method calls into Neo4j (optional)
-    neo4j_enabled = os.getenv("NEO4J_ENABLED", "true").lower() not in {"0", "false", "no"}
-    if not neo4j_enabled:
-        print("Skipping Neo4j insertion (NEO4J_ENABLED=false)")
-    else:
-        if not check_neo4j_connection():
-            print("Skipping Neo4j insertion (connection unavailable or authentication failed).")
-        else:
-            errors = 0
-            for call in tqdm(all_calls, desc="Neo4j method calls"):
+        if graph_queue is not None:
+            graph_queue.put({"repo": repo, "fragments": fragments})
+        embed_queue.put({"repo": repo, "path": path, "hash": file_hash, "fragments": fragments})
+
+def store_files(files: List[Dict[str, Any]], stats: Dict[Optional[str], Dict[str, int]],
+                lock: threading.Lock, progress: tqdm) -> None:
+    """Embed and insert the fragments of `files`, then record each fully stored file's hash.
+
+    A file whose fragments were not all stored keeps its old hash, so the next
+    incremental run picks it up again.
+    """
+    fragments = [frag for item in files for frag in item["fragments"]]
+    try:
+        embeddings = get_embeddings([frag["code"] for frag in fragments]) if fragments else []
+    except Exception as e:
+        print(f"Error embedding a batch of {len(fragments)} fragments: {e}")
+        embeddings = None
+
+    pos = 0
+    for item in files:
+        repo = item["repo"]
+        prefix = _prefix(repo)
+        frags = item["fragments"]
+        ok = embeddings is not None
+        if ok:
+            for frag, emb in zip(frags, embeddings[pos:pos + len(frags)]):
                 try:
-                    insert_method_call(call["caller"], call["callee"])
+                    frag["embedding"] = emb
+                    if repo is not None:
+                        frag["repo"] = repo
+                    insert_fragment(frag)
                 except Exception as e:
-                    errors += 1
-                    print(f"Error inserting call {call}: {e}")
-                    # If we get repeated auth/rate-limit errors, stop spamming
-                    if errors >= 5:
-                        print("Too many Neo4j errors; stopping further inserts. Check NEO4J_* credentials and server status.")
-                        break
+                    ok = False
+                    print(f"{prefix}Error processing {frag['symbol']}: {e}")
+        pos += len(frags)
 
-    print("\nIndexing summary:")
-    print(f"  Files discovered (.java): {total_files}")
-    if total_files == 0:
-        print("  Hint: Put your Java files under the folder above or set REPO_FOLDER to the correct path.")
-    if not full_rescan:
-        print(f"  Skipped (unchanged):      {skipped_files}")
-    print(f"  Processed:                {processed_files}")
+        if ok:
+            try:
+                update_file_hash(item["path"], item["hash"], repo)
+            except Exception as e:
+                ok = False
+                print(f"{prefix}Warning: failed to update hash for {item['path']}: {e}")
+        # A file counts as processed only once its hash is recorded
+        with lock:
+            stats[repo]["processed" if ok else "failed"] += 1
+        progress.update(len(frags))
+
+def embed_worker(embed_queue: "queue.Queue", stats: Dict[Optional[str], Dict[str, int]],
+                 lock: threading.Lock) -> None:
+    """Sole user of the model: drains parsed files and stores them in batches of EMBED_BATCH_SIZE fragments."""
+    pending: List[Dict[str, Any]] = []
+    pending_frags = 0
+    with tqdm(desc="Embeddings", unit="frag") as progress:
+        while True:
+            try:
+                item = embed_queue.get(timeout=1.0)
+            except queue.Empty:
+                item = False  # parsers are slow; flush what we have
+            if item is None:
+                break
+            if item:
+                pending.append(item)
+                pending_frags += len(item["fragments"])
+            if pending and (item is False or pending_frags >= EMBED_BATCH_SIZE):
+                store_files(pending, stats, lock, progress)
+                pending, pending_frags = [], 0
+        if pending:
+            store_files(pending, stats, lock, progress)
+
+def run_index(repos: List[Dict[str, Any]], full_rescan: bool, workers: int,
+              use_neo4j: bool) -> Dict[Optional[str], Dict[str, int]]:
+    """Index `repos` with `workers` parsing threads feeding one embedding consumer and one graph writer.
+
+    Returns per-repo file counts keyed by repo name (None for a plain REPO_FOLDER run).
+    """
+    stats = {r["name"]: {"total": 0, "skipped": 0, "processed": 0, "failed": 0, "neo4j_errors": 0}
+             for r in repos}
+    lock = threading.Lock()
+    embed_queue: "queue.Queue" = queue.Queue(maxsize=EMBED_QUEUE_FILES)
+    consumer = threading.Thread(target=embed_worker, args=(embed_queue, stats, lock), daemon=True)
+    consumer.start()
+    graph_queue: Optional["queue.Queue"] = None
+    if use_neo4j:
+        graph_queue = queue.Queue(maxsize=EMBED_QUEUE_FILES)
+        graph_writer = threading.Thread(target=graph_worker, args=(graph_queue, stats, lock), daemon=True)
+        graph_writer.start()
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [
+            (r, pool.submit(process_file_batch, r["name"], paths, full_rescan, stats, lock, embed_queue, graph_queue))
+            for r, paths in schedule_batches(repos)
+        ]
+        for r, future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                print(f"{_prefix(r['name'])}Indexing batch failed: {e}")
+
+    embed_queue.put(None)
+    if graph_queue is not None:
+        graph_queue.put(None)
+        graph_writer.join()
+    consumer.join()
+    return stats
 
+def check_neo4j_for_indexing() -> bool:
+    """Return True if graph inserts should run, printing why not otherwise."""
+    if not neo4j_enabled():
+        print("Skipping Neo4j insertion (NEO4J_ENABLED=false)")
+        return False
+    if not check_neo4j_connection():
+        print("Skipping Neo4j insertion (connection unavailable or authentication failed).")
+        return False
+    return True
+
+def print_graph_summary(use_neo4j: bool) -> None:
     # Neo4j graph summary (if enabled and reachable)
-    if neo4j_enabled and check_neo4j_connection():
+    if use_neo4j:
         n, r = count_methods_and_calls()
         if n is not None:
             print(f"  Neo4j Methods nodes:      {n}")
             print(f"  Neo4j CALLS relationships:{r}")
 
+def load_manifest(manifest_path: str) -> List[Dict[str, Any]]:
+    """Read a JSON manifest of repositories.
+
+    The manifest is a list (or {"repos": [...]}) whose entries are either a path
+    or an object with "path" and optional "name" and "priority" (higher runs first).
+    Raises ValueError for a path that is not a directory or a duplicate name.
+    """
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get("repos", [])
+
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    repos = []
+    seen = set()
+    for entry in data:
+        if isinstance(entry, str):
+            entry = {"path": entry}
+        # Relative paths are relative to the manifest, not the working directory
+        path = os.path.normpath(os.path.join(base_dir, os.path.expanduser(entry["path"])))
+        if not os.path.isdir(path):
+            raise ValueError(f"Repo path in manifest is not a directory: {entry['path']} ({path})")
+        name = entry.get("name") or os.path.basename(path)
+        if name in seen:
+            raise ValueError(f"Duplicate repo name in manifest: {name}")
+        seen.add(name)
+        repos.append({"name": name, "path": path, "priority": int(entry.get("priority", 0))})
+    return repos
+
+def main_manifest(manifest_path: str, full_rescan: bool = False, workers: int = INDEX_WORKERS):
+    """Index every repo in a manifest in one process, sharing the model and connections."""
+    repos = load_manifest(manifest_path)
+    print(f"Indexing starting. MANIFEST={manifest_path} ({len(repos)} repos, {workers} workers)")
+    print(f"Mode: {'FULL RESCAN' if full_rescan else 'INCREMENTAL (MD5 cache)'}")
+
+    use_neo4j = check_neo4j_for_indexing()
+    stats = run_index(repos, full_rescan, workers, use_neo4j)
+
+    print("\nIndexing summary:")
+    print("  REPO                           FILES  SKIPPED  PROCESSED  FAILED")
+    for r in sorted(repos, key=lambda r: -r["priority"]):
+        s = stats[r["name"]]
+        print(f"  {r['name'][:30]:<30} {s['total']:>5}  {s['skipped']:>7}  {s['processed']:>9}  {s['failed']:>6}")
+    print(f"  Repos indexed:            {len(repos)}")
+    print_graph_summary(use_neo4j)
+
+def main(full_rescan: bool = False, workers: int = INDEX_WORKERS):
+    print(f"Indexing starting. REPO_FOLDER={REPO_FOLDER}")
+    print(f"Mode: {'FULL RESCAN' if full_rescan else 'INCREMENTAL (MD5 cache)'}")
+
+    use_neo4j = check_neo4j_for_indexing()
+    stats = run_index([{"name": None, "path": REPO_FOLDER, "priority": 0}], full_rescan, workers, use_neo4j)[None]
+
+    print("\nIndexing summary:")
+    print(f"  Files discovered (.java): {stats['total']}")
+    if stats["total"] == 0:
+        print("  Hint: Put your Java files under the folder above or set REPO_FOLDER to the correct path.")
+    if not full_rescan:
+        print(f"  Skipped (unchanged):      {stats['skipped']}")
+    print(f"  Processed:                {stats['processed']}")
+    if stats["failed"]:
+        print(f"  Failed (retried next run):{stats['failed']}")
+
+    print_graph_summary(use_neo4j)
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Code Genius Indexer")
     parser.add_argument("--full-rescan", action="store_true", help="Re-scan all files regardless of MD5 cache")
+    parser.add_argument("--manifest", type=str, default=None,
+                        help="JSON manifest of repos to index in one run instead of REPO_FOLDER")
+    parser.add_argument("--workers", type=int, default=INDEX_WORKERS,
+                        help="Threads walking and parsing files (embedding always runs on one thread)")
     args = parser.parse_args()
 
-    main(full_rescan=args.full_rescan)
+    if args.manifest:
+        main_manifest(args.manifest, full_rescan=args.full_rescan, workers=args.workers)
+    else:
+        main(full_rescan=args.full_rescan, workers=args.workers)
@@ -17,25 +17,35 @@ def calculate_file_hash(file_path: str) -> str:
             hash_md5.update(chunk)
     return hash_md5.hexdigest()
 
-def get_file_hash(file_path: str) -> Optional[str]:
+def _hash_filter(file_path: str, repo: Optional[str]) -> Dict[str, Any]:
+    """Hash records are keyed by path, and by repo name when indexing from a manifest.
+
+    Plain REPO_FOLDER runs only see records without a repo, so they never
+    match or overwrite a manifest repo's record for the same path.
+    """
+    if repo is None:
+        return {"file_path": file_path, "repo": {"$exists": False}}
+    return {"repo": repo, "file_path": file_path}
+
+def get_file_hash(file_path: str, repo: Optional[str] = None) -> Optional[str]:
     """Get the stored hash of a file if it exists."""
-    result = file_hashes.find_one({"file_path": file_path})
+    result = file_hashes.find_one(_hash_filter(file_path, repo))
     return result["hash"] if result else None
 
-def update_file_hash(file_path: str, file_hash: str) -> None:
+def update_file_hash(file_path: str, file_hash: str, repo: Optional[str] = None) -> None:
     """Update the stored hash for a file."""
     file_hashes.update_one(
-        {"file_path": file_path},
+        _hash_filter(file_path, repo),
         {"$set": {"hash": file_hash}},
         upsert=True
     )
 
-def is_file_unchanged(file_path: str) -> bool:
+def is_file_unchanged(file_path: str, repo: Optional[str] = None) -> bool:
     """Check if a file has been modified since last scan."""
     if not os.path.exists(file_path):
         return False
         
-    stored_hash = get_file_hash(file_path)
+    stored_hash = get_file_hash(file_path, repo)
     if not stored_hash:
         return False
         
@@ -5,6 +5,9 @@ import os
 NEO4J_URI = os.getenv("NEO4J_URI", "bolt://localhost:7687")
 NEO4J_USER = os.getenv("NEO4J_USER", "neo4j")
 NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD", "test")
+# repo value for Method nodes from a plain REPO_FOLDER run; nodes created
+# before repo scoping have no repo property and are read as this value
+DEFAULT_REPO = ""
 
 _driver = None
 
@@ -29,17 +32,19 @@ def check_neo4j_connection() -> bool:
         print(f"Neo4j connection error: {e}")
         return False
 
-def insert_method_call(caller, callee):
+def insert_method_call(caller, callee, repo=None):
+    """MERGE a CALLS edge between Method nodes scoped to `repo` (DEFAULT_REPO for a plain REPO_FOLDER run)."""
     drv = _get_driver()
     with drv.session() as session:
         session.run(
             """
-            MERGE (c:Method {name:$caller})
-            MERGE (d:Method {name:$callee})
+            MERGE (c:Method {name:$caller, repo:$repo})
+            MERGE (d:Method {name:$callee, repo:$repo})
             MERGE (c)-[:CALLS]->(d)
             """,
             caller=caller,
-            callee=callee
+            callee=callee,
+            repo=DEFAULT_REPO if repo is None else repo
         )
 
 def count_methods_and_calls():
@@ -54,22 +59,28 @@ def count_methods_and_calls():
             print(f"Failed to count Neo4j nodes/relationships: {e}")
             return None, None
 
-def get_callees(method_name: str, limit: int = 10):
-    """Return a list of method names that are called by the given method."""
+def get_callees(method_name: str, limit: int = 10, repo=None):
+    """Return a list of method names that are called by the given method within `repo`."""
     drv = _get_driver()
     with drv.session() as session:
         q = (
             "MATCH (m:Method {name:$name})-[:CALLS]->(t:Method) "
-            "RETURN t.name AS name LIMIT $limit"
+            "WHERE coalesce(m.repo, $default_repo) = $repo "
+            "RETURN DISTINCT t.name AS name LIMIT $limit"
         )
-        return [rec["name"] for rec in session.run(q, name=method_name, limit=limit)]
+        repo = DEFAULT_REPO if repo is None else repo
+        return [rec["name"] for rec in session.run(q, name=method_name, limit=limit, repo=repo,
+                                                default_repo=DEFAULT_REPO)]
 
-def get_callers(method_name: str, limit: int = 10):
-    """Return a list of method names that call the given method."""
+def get_callers(method_name: str, limit: int = 10, repo=None):
+    """Return a list of method names that call the given method within `repo`."""
     drv = _get_driver()
     with drv.session() as session:
         q = (
             "MATCH (s:Method)-[:CALLS]->(m:Method {name:$name}) "
-            "RETURN s.name AS name LIMIT $limit"
+            "WHERE coalesce(m.repo, $default_repo) = $repo "
+            "RETURN DISTINCT s.name AS name LIMIT $limit"
         )
-        return [rec["name"] for rec in session.run(q, name=method_name, limit=limit)]
+        repo = DEFAULT_REPO if repo is None else repo
+        return [rec["name"] for rec in session.run(q, name=method_name, limit=limit, repo=repo,
+                                                default_repo=DEFAULT_REPO)]
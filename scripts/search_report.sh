@@ -17,7 +17,7 @@ fi
 source "$REPO_ROOT/.venv/bin/activate"
 
 if [ "$#" -lt 1 ]; then
-  echo "Usage: scripts/search_report.sh \"<query>\" [-k TOP_K] [-o out.html] [--no-graph] [--open|--no-open]" >&2
+  echo "Usage: scripts/search_report.sh \"<query>\" [-k TOP_K] [-o out.html] [--no-graph] [--page-size N] [--open|--no-open]" >&2
   exit 1
 fi
 
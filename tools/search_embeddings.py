@@ -1,12 +1,16 @@
 #!/usr/bin/env python3
 import argparse
+import heapq
+import json
+import multiprocessing
 import os
 import sys
-from typing import List, Dict, Any
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
 
+from bson import ObjectId
 from pymongo import MongoClient
 import numpy as np
-from sentence_transformers import SentenceTransformer
 
 # Ensure project root is on sys.path so we can import neo4j_utils
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -24,13 +28,73 @@ MODEL_NAME = os.getenv("MODEL_NAME", "all-MiniLM-L6-v2")
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
 DB_NAME = os.getenv("DB_NAME", "code_index")
 COLLECTION_NAME = os.getenv("COLLECTION_NAME", "code_memory")
+SEARCH_WORKERS = int(os.getenv("SEARCH_WORKERS", "1"))
+SHARD_ROWS = int(os.getenv("SEARCH_SHARD_ROWS", "50000"))
+SHARD_ALIGN = 64  # shard sizes are rounded up to this many rows
+CACHE_DIR = os.getenv("SEARCH_CACHE_DIR", os.path.join(BASE_DIR, ".search_cache"))
 
+# Memory-mapped embedding matrix opened once per worker process
+_shard_matrix: Optional[np.ndarray] = None
 
-def cosine_sim(a: np.ndarray, b: np.ndarray) -> float:
-    denom = (np.linalg.norm(a) * np.linalg.norm(b))
-    if denom == 0:
-        return 0.0
-    return float(np.dot(a, b) / denom)
+
+def score_rows(matrix: np.ndarray, q: np.ndarray) -> np.ndarray:
+    """Cosine similarity of every row in `matrix` against `q` (0.0 where a norm is zero)."""
+    dots = matrix @ q
+    denom = np.linalg.norm(matrix, axis=1) * np.linalg.norm(q)
+    scores = np.zeros(len(matrix), dtype=np.float32)
+    np.divide(dots, denom, out=scores, where=denom != 0)
+    return scores
+
+
+def top_k_indices(scores: np.ndarray, k: int, offset: int = 0) -> List[Tuple[float, int]]:
+    """Return (score, row) pairs for the k best rows, keeping every row tied with the k-th score.
+
+    Keeping boundary ties lets shards be merged into exactly the order a stable
+    descending sort over the whole matrix would produce.
+    """
+    if k <= 0 or len(scores) == 0:
+        return []
+    if k < len(scores):
+        kth = np.partition(scores, len(scores) - k)[len(scores) - k]
+        idx = np.nonzero(scores >= kth)[0]
+    else:
+        idx = np.arange(len(scores))
+    return [(float(scores[i]), int(i) + offset) for i in idx]
+
+
+def merge_top_k(parts: List[List[Tuple[float, int]]], k: int) -> List[Tuple[float, int]]:
+    """Merge per-shard candidates; ties are broken by row order like a stable sort."""
+    candidates = (c for part in parts for c in part)
+    return heapq.nlargest(k, candidates, key=lambda c: (c[0], -c[1]))
+
+
+def _init_shard_worker(path: str, n_rows: int, dim: int) -> None:
+    global _shard_matrix
+    _shard_matrix = np.memmap(path, dtype=np.float32, mode="r", shape=(n_rows, dim))
+
+
+def _search_shard(task: Tuple[int, int, np.ndarray, int]) -> List[Tuple[float, int]]:
+    start, stop, q, k = task
+    scores = score_rows(np.asarray(_shard_matrix[start:stop]), q)
+    return top_k_indices(scores, k, offset=start)
+
+
+def sharded_top_k(path: str, n_rows: int, dim: int, q: np.ndarray, k: int,
+                  workers: int, shard_rows: int = SHARD_ROWS) -> List[Tuple[float, int]]:
+    """Exact top-k over a memory-mapped float32 matrix, one shard per task across a process pool.
+
+    Workers are never forked: by now the process runs MongoClient monitor
+    threads and torch, and forking a multithreaded process can deadlock.
+    """
+    # Shard edges must fall on a multiple of the BLAS unroll width, otherwise
+    # edge rows are summed differently than in a full-matrix `matrix @ q`
+    shard_rows = -(-max(1, shard_rows) // SHARD_ALIGN) * SHARD_ALIGN
+    tasks = [(start, min(start + shard_rows, n_rows), q, k) for start in range(0, n_rows, shard_rows)]
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method),
+                             initializer=_init_shard_worker, initargs=(path, n_rows, dim)) as pool:
+        parts = list(pool.map(_search_shard, tasks))
+    return merge_top_k(parts, k)
 
 
 def load_embeddings(col) -> List[Dict[str, Any]]:
@@ -39,30 +103,168 @@ def load_embeddings(col) -> List[Dict[str, Any]]:
         "symbol": 1,
         "type": 1,
         "file_path": 1,
+        "repo": 1,
         "embedding": 1,
         "code": 1,
     })
     results = []
+    dim = 0
     for doc in cursor:
         emb = doc.get("embedding")
         if isinstance(emb, list) and len(emb) > 0:
+            # Same rule as build_shard_cache so both search paths see the same rows
+            if dim == 0:
+                dim = len(emb)
+            elif len(emb) != dim:
+                print(f"Skipping {doc.get('symbol')}: embedding has {len(emb)} dims, expected {dim}", file=sys.stderr)
+                continue
             results.append({
                 "symbol": doc.get("symbol"),
                 "type": doc.get("type"),
                 "file_path": doc.get("file_path", "-"),
+                "repo": doc.get("repo"),
                 "embedding": np.array(emb, dtype=np.float32),
                 "code": doc.get("code"),
             })
     return results
 
 
+def collection_fingerprint(col) -> Dict[str, Any]:
+    """Cheap change marker for the collection.
+
+    The indexer only inserts fragments and the reset tools delete everything,
+    so the document count together with the newest _id changes whenever the
+    stored embeddings do.
+    """
+    last = col.find_one({}, projection={"_id": 1}, sort=[("_id", -1)])
+    return {"count": col.estimated_document_count(), "last_id": str(last["_id"]) if last else None}
+
+
+def build_shard_cache(col, cache_dir: str, fingerprint: Dict[str, Any]) -> Dict[str, Any]:
+    """Stream embeddings into a raw float32 row-major file plus a file of 12-byte ObjectIds.
+
+    The metadata file is written last, so a cache directory without a matching
+    meta.json is never read. Returns the metadata.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    suffix = f".tmp{os.getpid()}"
+    emb_path = os.path.join(cache_dir, "embeddings.f32")
+    ids_path = os.path.join(cache_dir, "ids.bin")
+    cursor = col.find({"embedding": {"$exists": True}}, projection={"embedding": 1}, batch_size=2048)
+    rows = 0
+    dim = 0
+    chunk: List[List[float]] = []
+    with open(emb_path + suffix, "wb") as emb_f, open(ids_path + suffix, "wb") as ids_f:
+        def flush():
+            if chunk:
+                np.asarray(chunk, dtype=np.float32).tofile(emb_f)
+                chunk.clear()
+
+        for doc in cursor:
+            emb = doc.get("embedding")
+            if not isinstance(emb, list) or len(emb) == 0:
+                continue
+            if dim == 0:
+                dim = len(emb)
+            elif len(emb) != dim:
+                print(f"Skipping {doc['_id']}: embedding has {len(emb)} dims, expected {dim}", file=sys.stderr)
+                continue
+            chunk.append(emb)
+            ids_f.write(doc["_id"].binary)
+            rows += 1
+            if len(chunk) >= 4096:
+                flush()
+        flush()
+    os.replace(emb_path + suffix, emb_path)
+    os.replace(ids_path + suffix, ids_path)
+
+    meta = {"fingerprint": fingerprint, "rows": rows, "dim": dim}
+    meta_path = os.path.join(cache_dir, "meta.json")
+    with open(meta_path + suffix, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(meta_path + suffix, meta_path)
+    return meta
+
+
+def load_shard_cache(col, cache_dir: str) -> Dict[str, Any]:
+    """Return the shard cache metadata, rebuilding the cache if the collection changed."""
+    fingerprint = collection_fingerprint(col)
+    try:
+        with open(os.path.join(cache_dir, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("fingerprint") == fingerprint:
+            return meta
+    except (OSError, ValueError):
+        pass
+    print(f"Building shard cache in {cache_dir}...", file=sys.stderr)
+    return build_shard_cache(col, cache_dir, fingerprint)
+
+
+def search_in_memory(col, q_emb: np.ndarray, top_k: int) -> List[Dict[str, Any]]:
+    print("Fetching embeddings from MongoDB...", file=sys.stderr)
+    items = load_embeddings(col)
+    if not items:
+        print("No embeddings found. Have you run the indexer?", file=sys.stderr)
+        sys.exit(1)
+
+    print("Computing similarities...", file=sys.stderr)
+    matrix = np.stack([it["embedding"] for it in items])
+    best = top_k_indices(score_rows(matrix, q_emb), top_k)
+    return [
+        {"score": score, **{k: v for k, v in items[i].items() if k != "embedding"}}
+        for score, i in merge_top_k([best], top_k)
+    ]
+
+
+def search_sharded(col, q_emb: np.ndarray, top_k: int, workers: int,
+                   shard_rows: int, cache_dir: str) -> List[Dict[str, Any]]:
+    meta = load_shard_cache(col, cache_dir)
+    if meta["rows"] == 0:
+        print("No embeddings found. Have you run the indexer?", file=sys.stderr)
+        sys.exit(1)
+
+    print(f"Computing similarities ({workers} workers, {shard_rows} rows/shard)...", file=sys.stderr)
+    best = sharded_top_k(os.path.join(cache_dir, "embeddings.f32"), meta["rows"], meta["dim"],
+                         q_emb, top_k, workers, shard_rows)
+
+    # Only the winners' documents are fetched from MongoDB
+    ids = np.memmap(os.path.join(cache_dir, "ids.bin"), dtype=np.uint8, mode="r", shape=(meta["rows"], 12))
+    winners = [(score, ObjectId(ids[i].tobytes())) for score, i in best]
+    docs = {doc["_id"]: doc for doc in col.find(
+        {"_id": {"$in": [oid for _, oid in winners]}},
+        projection={"symbol": 1, "type": 1, "file_path": 1, "repo": 1, "code": 1})}
+    top = []
+    for score, oid in winners:
+        doc = docs.get(oid)
+        if doc is None:
+            continue
+        top.append({
+            "score": score,
+            "symbol": doc.get("symbol"),
+            "type": doc.get("type"),
+            "file_path": doc.get("file_path", "-"),
+            "repo": doc.get("repo"),
+            "code": doc.get("code"),
+        })
+    return top
+
+
 def main():
     parser = argparse.ArgumentParser(description="Search similar code fragments using embeddings")
     parser.add_argument("query", type=str, help="Natural language or code-like query")
     parser.add_argument("-k", "--top_k", type=int, default=10, help="How many results to return")
     parser.add_argument("--show-code", action="store_true", help="Show a prefix of the code (if available)")
     parser.add_argument("--with-graph", action="store_true", help="Show callers/callees from Neo4j for top 5 matches")
+    parser.add_argument("--workers", type=int, default=SEARCH_WORKERS,
+                        help="Worker processes for sharded search (1 = in-memory search, 0 = all CPUs)")
+    parser.add_argument("--shard-rows", type=int, default=SHARD_ROWS, help="Embeddings per shard in sharded search")
+    parser.add_argument("--cache-dir", type=str, default=CACHE_DIR,
+                        help="Directory for the memory-mapped shard cache used by sharded search")
     args = parser.parse_args()
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+
+    # Imported here so shard workers, which re-import this script, don't load torch
+    from sentence_transformers import SentenceTransformer
 
     print("Loading embedding model...", file=sys.stderr)
     model = SentenceTransformer(MODEL_NAME)
@@ -72,23 +274,11 @@ def main():
     client = MongoClient(MONGO_URI)
     col = client[DB_NAME][COLLECTION_NAME]
 
-    print("Fetching embeddings from MongoDB...", file=sys.stderr)
-    items = load_embeddings(col)
-    if not items:
-        print("No embeddings found. Have you run the indexer?", file=sys.stderr)
-        sys.exit(1)
-
-    print("Computing similarities...", file=sys.stderr)
-    scored = []
-    for it in items:
-        score = cosine_sim(q_emb, it["embedding"])
-        scored.append({
-            "score": score,
-            **{k: v for k, v in it.items() if k != "embedding"},
-        })
-
-    scored.sort(key=lambda x: x["score"], reverse=True)
-    top = scored[: args.top_k]
+    if workers > 1:
+        cache_dir = os.path.join(args.cache_dir, f"{DB_NAME}.{COLLECTION_NAME}")
+        top = search_sharded(col, q_emb, args.top_k, workers, args.shard_rows, cache_dir)
+    else:
+        top = search_in_memory(col, q_emb, args.top_k)
 
     # Pretty print
     print("RESULTS (top {}):".format(args.top_k))
@@ -113,8 +303,8 @@ def main():
             if neo4j_enabled and check_neo4j_connection and check_neo4j_connection():
                 name = str(r.get('symbol') or '')
                 try:
-                    callees = get_callees(name, limit=10) or []
-                    callers = get_callers(name, limit=10) or []
+                    callees = get_callees(name, limit=10, repo=r.get('repo')) or []
+                    callers = get_callers(name, limit=10, repo=r.get('repo')) or []
                     if callees or callers:
                         print("    Graph context:")
                         if callers:
@@ -1,8 +1,9 @@
 #!/usr/bin/env python3
 import argparse
+import hashlib
 import os
 import sys
-from typing import List, Dict, Any
+from typing import Iterable, Iterator, List, Dict, Any
 
 from pymongo import MongoClient
 import numpy as np
@@ -34,24 +35,25 @@ def cosine_sim(a: np.ndarray, b: np.ndarray) -> float:
 
 
 def load_embeddings(col) -> List[Dict[str, Any]]:
+    # Code is left out here and fetched for the top results only (see with_code)
     cursor = col.find({}, projection={
-        "_id": 0,
         "symbol": 1,
         "type": 1,
         "file_path": 1,
+        "repo": 1,
         "embedding": 1,
-        "code": 1,
     })
     results = []
     for doc in cursor:
         emb = doc.get("embedding")
         if isinstance(emb, list) and len(emb) > 0:
             results.append({
+                "_id": doc["_id"],
                 "symbol": doc.get("symbol"),
                 "type": doc.get("type"),
                 "file_path": doc.get("file_path", "-"),
+                "repo": doc.get("repo"),
                 "embedding": np.array(emb, dtype=np.float32),
-                "code": doc.get("code") or "",
             })
     return results
 
@@ -74,8 +76,60 @@ def build_mermaid(symbol: str, callers: List[str], callees: List[str]) -> str:
     return "\n".join(lines)
 
 
-def render_html(query: str, rows: List[Dict[str, Any]], out_path: str) -> None:
-    # Basic, self-contained HTML with Mermaid for graphs
+PAGE_SIZE = int(os.getenv("REPORT_PAGE_SIZE", "50"))
+SNIPPET_LINES = 60
+
+# Expanding a result fills in its code from the shared source template and
+# renders its Mermaid graph; nothing heavy is laid out until it is needed.
+REPORT_SCRIPT = """<script>
+(function () {
+  var pages = document.querySelectorAll('section.page');
+  var label = document.getElementById('page-label');
+  var current = 0;
+  function show(n) {
+    if (!pages.length) { return; }
+    pages[current].hidden = true;
+    current = Math.max(0, Math.min(n, pages.length - 1));
+    pages[current].hidden = false;
+    label.textContent = 'Page ' + (current + 1) + ' of ' + pages.length;
+    window.scrollTo(0, 0);
+  }
+  document.getElementById('prev').onclick = function () { show(current - 1); };
+  document.getElementById('next').onclick = function () { show(current + 1); };
+  if (pages.length <= 1) { document.querySelector('.pager').hidden = true; }
+  show(0);
+
+  document.addEventListener('toggle', function (e) {
+    var d = e.target;
+    if (!d.open || d.dataset.rendered) { return; }
+    d.dataset.rendered = '1';
+    if (d.dataset.src) {
+      d.querySelector('code').textContent = document.getElementById(d.dataset.src).content.textContent;
+    } else if (d.classList.contains('graph')) {
+      var pre = document.createElement('pre');
+      pre.className = 'mermaid';
+      pre.textContent = d.querySelector('template').content.textContent;
+      d.appendChild(pre);
+      if (window.mermaid) { window.mermaid.run({ nodes: [pre] }); }
+    }
+  }, true);
+})();
+</script>
+"""
+
+
+def _source_key(file_path: str, snippet: str) -> str:
+    return hashlib.sha1(f"{file_path}\0{snippet}".encode("utf-8", "replace")).hexdigest()
+
+
+def render_html(query: str, rows: Iterable[Dict[str, Any]], out_path: str, page_size: int = PAGE_SIZE) -> None:
+    """Stream the report to `out_path` one result at a time.
+
+    Each distinct source snippet is written once as a <template> and referenced
+    by every hit from it; code and graphs are only rendered when expanded, and
+    results are split into pages of `page_size`.
+    """
+    page_size = max(1, page_size)
     head = f"""<!DOCTYPE html>
 <html>
 <head>
@@ -87,46 +141,97 @@ def render_html(query: str, rows: List[Dict[str, Any]], out_path: str) -> None:
     .result {{ border: 1px solid #e2e2e2; border-radius: 8px; padding: 12px; margin-bottom: 16px; }}
     .meta {{ font-size: 12px; color: #666; margin-bottom: 8px; }}
     pre {{ background: #0b1021; color: #f2f2f2; padding: 12px; border-radius: 6px; overflow: auto; }}
+    pre.mermaid {{ background: #fff; color: inherit; }}
     code {{ white-space: pre; }}
     .title {{ font-weight: 600; font-size: 16px; margin-bottom: 6px; }}
     .score {{ color: #555; }}
-    .section-label {{ font-weight: 600; margin: 10px 0 6px; }}
+    summary {{ font-weight: 600; margin: 10px 0 6px; cursor: pointer; }}
+    .pager {{ margin: 12px 0; }}
   </style>
-  <script type=\"module\" src=\"https://cdn.jsdelivr.net/npm/mermaid@10/dist/mermaid.esm.min.mjs\"></script>
-  <script>mermaid.initialize({{ startOnLoad: true, securityLevel: 'loose' }});</script>
+  <script type=\"module\">
+    import mermaid from 'https://cdn.jsdelivr.net/npm/mermaid@10/dist/mermaid.esm.min.mjs';
+    mermaid.initialize({{ startOnLoad: false, securityLevel: 'loose' }});
+    window.mermaid = mermaid;
+    mermaid.run();
+  </script>
 </head>
 <body>
   <h1>Semantic Search Report</h1>
   <div class=\"meta\">Query: <b>{html_escape(query)}</b></div>
+  <div class=\"pager\"><button id=\"prev\">&lsaquo; Prev</button> <span id=\"page-label\"></span> <button id=\"next\">Next &rsaquo;</button></div>
 """
 
-    body_parts = []
-    for i, r in enumerate(rows, 1):
-        title = f"{r['type']} · {r['symbol']}"
-        meta = f"File: {r['file_path']} · Score: {r['score']:.4f}"
-        code_snippet = html_escape("\n".join((r.get('code') or '').splitlines()[:60]))
-        mermaid = r.get('mermaid')
-        graph_block = f"<pre class=\"mermaid\">\n{html_escape(mermaid)}\n</pre>" if mermaid else "<div class=\"meta\">No graph context</div>"
-        body_parts.append(
-            f"""
+    # digest -> template id; only hashes are kept, not the sources themselves
+    source_ids: Dict[str, str] = {}
+
+    with open(out_path, "w", encoding="utf-8") as f:
+        f.write(head)
+        i = 0
+        for i, r in enumerate(rows, 1):
+            if (i - 1) % page_size == 0:
+                if i > 1:
+                    f.write("</section>\n")
+                f.write(f"<section class=\"page\" data-page=\"{(i - 1) // page_size + 1}\" hidden>\n")
+
+            snippet = "\n".join((r.get('code') or '').splitlines()[:SNIPPET_LINES])
+            key = _source_key(str(r['file_path']), snippet)
+            src_id = source_ids.get(key)
+            if src_id is None:
+                src_id = f"src-{len(source_ids) + 1}"
+                source_ids[key] = src_id
+                f.write(f"<template id=\"{src_id}\">{html_escape(snippet)}</template>\n")
+
+            title = f"{r['type']} · {r['symbol']}"
+            meta = f"File: {r['file_path']} · Score: {r['score']:.4f}"
+            mermaid = r.get('mermaid')
+            if mermaid:
+                graph_block = f"<details class=\"graph\"><summary>Graph</summary><template>{html_escape(mermaid)}</template></details>"
+            else:
+                graph_block = "<div class=\"meta\">No graph context</div>"
+            f.write(
+                f"""
 <div class=\"result\">
   <div class=\"title\">{html_escape(title)}</div>
   <div class=\"meta\">{html_escape(meta)}</div>
-  <div class=\"section-label\">Code</div>
-  <pre><code>{code_snippet}</code></pre>
-  <div class=\"section-label\">Graph</div>
+  <details class=\"code\" data-src=\"{src_id}\"><summary>Code</summary><pre><code></code></pre></details>
   {graph_block}
 </div>
 """
-        )
+            )
 
-    tail = "</body>\n</html>\n"
+        if i > 0:
+            f.write("</section>\n")
+        f.write(REPORT_SCRIPT)
+        f.write("</body>\n</html>\n")
 
-    with open(out_path, "w", encoding="utf-8") as f:
-        f.write(head)
-        for part in body_parts:
-            f.write(part)
-        f.write(tail)
+
+def with_code(col, top: List[Dict[str, Any]], batch_size: int) -> Iterator[Dict[str, Any]]:
+    """Yield result rows with their code, fetched by _id one batch at a time."""
+    batch_size = max(1, batch_size)
+    for start in range(0, len(top), batch_size):
+        batch = top[start:start + batch_size]
+        codes = {doc["_id"]: doc.get("code") for doc in col.find(
+            {"_id": {"$in": [r["_id"] for r in batch]}}, projection={"code": 1})}
+        for r in batch:
+            entry = {k: v for k, v in r.items() if k != "_id"}
+            entry["code"] = codes.get(r["_id"]) or ""
+            yield entry
+
+
+def with_graphs(rows: Iterable[Dict[str, Any]], can_graph: bool) -> Iterator[Dict[str, Any]]:
+    """Yield result rows with their Mermaid graph, looked up as the report is written."""
+    for r in rows:
+        entry = dict(r)
+        entry['mermaid'] = None
+        if can_graph:
+            name = str(r.get('symbol') or '')
+            try:
+                callees = get_callees(name, limit=12, repo=r.get('repo')) or []
+                callers = get_callers(name, limit=12, repo=r.get('repo')) or []
+                entry['mermaid'] = build_mermaid(name, callers, callees)
+            except Exception:
+                pass
+        yield entry
 
 
 def main():
@@ -135,6 +240,7 @@ def main():
     p.add_argument("-k", "--top_k", type=int, default=10)
     p.add_argument("-o", "--out", type=str, default="search_report.html")
     p.add_argument("--no-graph", action="store_true", help="Do not query Neo4j for graph context")
+    p.add_argument("--page-size", type=int, default=PAGE_SIZE, help="Results per report page")
     args = p.parse_args()
 
     print("Loading embedding model...", file=sys.stderr)
@@ -164,27 +270,12 @@ def main():
     top = scored[: args.top_k]
 
     # Optionally add Mermaid graphs
-    rows = []
     neo4j_enabled = os.getenv("NEO4J_ENABLED", "true").lower() not in {"0", "false", "no"}
     can_graph = (not args.no_graph) and check_neo4j_connection and neo4j_enabled and check_neo4j_connection()
 
-    for idx, r in enumerate(top, 1):
-        entry = dict(r)
-        if can_graph:
-            name = str(r.get('symbol') or '')
-            try:
-                callees = get_callees(name, limit=12) or []
-                callers = get_callers(name, limit=12) or []
-                entry['mermaid'] = build_mermaid(name, callers, callees)
-            except Exception as e:
-                entry['mermaid'] = None
-        else:
-            entry['mermaid'] = None
-        rows.append(entry)
-
     print(f"Writing report: {args.out}", file=sys.stderr)
-    render_html(args.query, rows, args.out)
-
+    rows = with_graphs(with_code(col, top, args.page_size), bool(can_graph))
+    render_html(args.query, rows, args.out, page_size=args.page_size)
 
 if __name__ == "__main__":
     main()